@@ -1,36 +1,98 @@
+import base64
 import hashlib
+import hmac
+import os
 import secrets
-from datetime import datetime, timedelta
+import time
+from collections import deque
+from datetime import datetime
 from database import (
-    create_user, get_user_by_username, get_user_by_id,
-    create_session, get_session, delete_session, delete_user_sessions
+    create_user, get_user_by_username,
+    create_session, get_session_with_user, delete_session, delete_user_sessions
 )
+from cache import TTLCache
 
 SESSION_DURATION_DAYS = 30
+SESSION_DURATION_SECONDS = SESSION_DURATION_DAYS * 86400
+SESSION_CACHE_TTL = 60
+
+# Validated sessions keyed by session_token; cleared on logout
+_session_cache = TTLCache(ttl=SESSION_CACHE_TTL, maxsize=10000)
+
+# Recent successful logins, so rapid retries skip the KDF. Keys are keyed
+# hashes of the credentials; the secret never leaves this process.
+VERIFY_CACHE_TTL = 30
+_verify_cache = TTLCache(ttl=VERIFY_CACHE_TTL, maxsize=1024)
+_PROCESS_SECRET = secrets.token_bytes(32)
+
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_DKLEN = 32
 
 def hash_password(password: str) -> str:
-    salt = secrets.token_hex(16)
+    salt = os.urandom(16)
+    pwd_hash = hashlib.scrypt(
+        password.encode('utf-8'),
+        salt=salt,
+        n=SCRYPT_N,
+        r=SCRYPT_R,
+        p=SCRYPT_P,
+        dklen=SCRYPT_DKLEN
+    )
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${pwd_hash.hex()}"
+
+def _verify_legacy_pbkdf2(password: str, password_hash: str) -> bool:
+    # Hashes created before the scrypt switch are stored as "salt$hash"
+    salt, stored_hash = password_hash.split('$')
     pwd_hash = hashlib.pbkdf2_hmac(
         'sha256',
         password.encode('utf-8'),
         salt.encode('utf-8'),
         100000
     )
-    return f"{salt}${pwd_hash.hex()}"
+    return secrets.compare_digest(pwd_hash, bytes.fromhex(stored_hash))
 
 def verify_password(password: str, password_hash: str) -> bool:
     try:
-        salt, stored_hash = password_hash.split('$')
-        pwd_hash = hashlib.pbkdf2_hmac(
-            'sha256',
+        if not password_hash.startswith('scrypt$'):
+            return _verify_legacy_pbkdf2(password, password_hash)
+        _, n, r, p, salt, stored_hash = password_hash.split('$')
+        expected = bytes.fromhex(stored_hash)
+        pwd_hash = hashlib.scrypt(
             password.encode('utf-8'),
-            salt.encode('utf-8'),
-            100000
+            salt=bytes.fromhex(salt),
+            n=int(n),
+            r=int(r),
+            p=int(p),
+            dklen=len(expected)
         )
-        return secrets.compare_digest(pwd_hash.hex(), stored_hash)
+        return secrets.compare_digest(pwd_hash, expected)
     except ValueError:
         return False
 
+def _verify_cache_key(username: str, password: str, password_hash: str) -> bytes:
+    message = b"\0".join((username.encode('utf-8'), password.encode('utf-8'), password_hash.encode('utf-8')))
+    return hmac.new(_PROCESS_SECRET, message, "sha256").digest()
+
+# Random tokens are cut from one urandom read per batch instead of one read each.
+# A forked child starts with an empty pool so it never hands out its parent's tokens
+TOKEN_POOL_BATCH = 256
+_token_pool: deque = deque()
+os.register_at_fork(after_in_child=_token_pool.clear)
+
+def generate_token() -> str:
+    """URL-safe token from 32 random bytes, same format as secrets.token_urlsafe(32)"""
+    try:
+        return _token_pool.popleft()
+    except IndexError:
+        raw = secrets.token_bytes(32 * TOKEN_POOL_BATCH)
+        _token_pool.extend(
+            base64.urlsafe_b64encode(raw[i:i + 32]).rstrip(b"=").decode("ascii")
+            for i in range(0, len(raw), 32)
+        )
+        return _token_pool.popleft()
+
 def generate_session_token() -> str:
     return secrets.token_urlsafe(32)
 
@@ -57,11 +119,14 @@ def login_user(username: str, password: str) -> dict:
     if not user:
         return {"success": False, "error": "Tên đăng nhập hoặc mật khẩu không đúng"}
     
-    if not verify_password(password, user['password_hash']):
-        return {"success": False, "error": "Tên đăng nhập hoặc mật khẩu không đúng"}
+    cache_key = _verify_cache_key(username, password, user['password_hash'])
+    if not _verify_cache.get(cache_key):
+        if not verify_password(password, user['password_hash']):
+            return {"success": False, "error": "Tên đăng nhập hoặc mật khẩu không đúng"}
+        _verify_cache.set(cache_key, True)
     
     session_token = generate_session_token()
-    expires_at = datetime.now() + timedelta(days=SESSION_DURATION_DAYS)
+    expires_at = int(time.time()) + SESSION_DURATION_SECONDS
     
     try:
         create_session(user['id'], session_token, expires_at)
@@ -70,7 +135,7 @@ def login_user(username: str, password: str) -> dict:
             "session_token": session_token,
             "user_id": user['id'],
             "username": user['username'],
-            "expires_at": expires_at.isoformat()
+            "expires_at": datetime.fromtimestamp(expires_at).isoformat()
         }
     except Exception as e:
         return {"success": False, "error": f"Lỗi tạo phiên: {str(e)}"}
@@ -79,21 +144,26 @@ def validate_session(session_token: str) -> dict | None:
     if not session_token:
         return None
     
-    session = get_session(session_token)
-    if not session:
-        return None
+    cached = _session_cache.get(session_token)
+    if cached:
+        return cached
     
-    user = get_user_by_id(session['user_id'])
-    if not user:
+    session = get_session_with_user(session_token)
+    if not session:
         return None
     
-    return {
-        "id": user['id'],
-        "username": user['username'],
+    result = {
+        "id": session['user_id'],
+        "username": session['username'],
         "session_token": session_token
     }
+    # Never keep a session cached past its expiry
+    remaining = session['expires_at'] - time.time()
+    _session_cache.set(session_token, result, ttl=min(SESSION_CACHE_TTL, remaining))
+    return result
 
 def logout_user(session_token: str) -> bool:
+    _session_cache.pop(session_token)
     try:
         delete_session(session_token)
         return True
@@ -101,6 +171,7 @@ def logout_user(session_token: str) -> bool:
         return False
 
 def logout_all_sessions(user_id: int) -> bool:
+    _session_cache.pop_matching(lambda user: user["id"] == user_id)
     try:
         delete_user_sessions(user_id)
         return True
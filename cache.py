@@ -0,0 +1,62 @@
+import threading
+import time
+
+
+class TTLCache:
+    """Small thread-safe in-memory cache with per-entry expiry"""
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if time.monotonic() >= expires:
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data.pop(key, None)
+            if len(self._data) >= self.maxsize:
+                self._evict()
+            self._data[key] = (expires, value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def pop_matching(self, predicate):
+        """Drop every entry whose value satisfies predicate"""
+        with self._lock:
+            keys = [k for k, (_, value) in self._data.items() if predicate(value)]
+            for k in keys:
+                del self._data[k]
+
+    def items(self) -> list:
+        """Snapshot of the live (key, value) pairs"""
+        now = time.monotonic()
+        with self._lock:
+            return [(k, value) for k, (expires, value) in self._data.items() if now < expires]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def _evict(self):
+        now = time.monotonic()
+        expired = [k for k, (expires, _) in self._data.items() if now >= expires]
+        for k in expired:
+            del self._data[k]
+        # Still full: drop the oldest insertions first
+        while len(self._data) >= self.maxsize:
+            del self._data[next(iter(self._data))]
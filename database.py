@@ -1,5 +1,7 @@
 import sqlite3
 import os
+import threading
+import time
 from datetime import datetime
 from contextlib import contextmanager
 
@@ -10,21 +12,62 @@ if ENVIRONMENT == "production":
 else:
     DB_PATH = os.path.join(os.path.dirname(__file__), "spotify_controller.db")
 
+# One long-lived connection per thread instead of open/close per query
+_local = threading.local()
+
+# Bump when init_db() gains a migration; databases already at this
+# version skip the whole schema block
+SCHEMA_VERSION = 1
+_schema_lock = threading.Lock()
+_schema_ready = False
+
 def get_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        # Autocommit mode: transactions are opened explicitly in get_db()
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA cache_size=-20000")
+        _local.conn = conn
+        if not _schema_ready:
+            init_db()
     return conn
 
 @contextmanager
 def get_db():
+    """Connection inside a write transaction, committed on exit"""
     conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
     try:
         yield conn
-        conn.commit()
-    finally:
-        conn.close()
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+@contextmanager
+def get_db_ro():
+    """Connection for single SELECTs - autocommit, no transaction to commit"""
+    yield get_connection()
 
 def init_db():
+    """Create/migrate the schema once per process; cheap no-op afterwards"""
+    global _schema_ready
+    # Opening this thread's connection may itself run the migration
+    conn = get_connection()
+    with _schema_lock:
+        if _schema_ready:
+            return
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            _migrate()
+        _schema_ready = True
+
+def _migrate():
     with get_db() as conn:
         cursor = conn.cursor()
         
@@ -55,10 +98,9 @@ def init_db():
         """)
         
         # Migration: Add validated column if not exists
-        try:
+        columns = {row["name"] for row in cursor.execute("PRAGMA table_info(user_configs)")}
+        if "validated" not in columns:
             cursor.execute("ALTER TABLE user_configs ADD COLUMN validated INTEGER DEFAULT 0")
-        except:
-            pass  # Column already exists
         
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS sessions (
@@ -71,8 +113,28 @@ def init_db():
             )
         """)
         
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_token ON sessions(session_token)")
+        # Migration: session expiry used to be stored as local-time ISO text
+        cursor.execute("""
+            UPDATE sessions SET expires_at = CAST(strftime('%s', expires_at, 'utc') AS INTEGER)
+            WHERE typeof(expires_at) = 'text'
+        """)
+        
+        # Every new user gets an empty config row without a second statement
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_create_user_config AFTER INSERT ON users
+            BEGIN
+                INSERT INTO user_configs (user_id) VALUES (NEW.id);
+            END
+        """)
+        
+        # Covers session lookups so they never touch the table B-tree;
+        # supersedes the old single-column token index
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_token_covering ON sessions(session_token, expires_at, user_id)")
+        cursor.execute("DROP INDEX IF EXISTS idx_sessions_token")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_configs_api_key ON user_configs(app_api_key)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
+        
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
 
 def create_user(username: str, password_hash: str) -> int:
     with get_db() as conn:
@@ -81,28 +143,23 @@ def create_user(username: str, password_hash: str) -> int:
             "INSERT INTO users (username, password_hash) VALUES (?, ?)",
             (username, password_hash)
         )
-        user_id = cursor.lastrowid
-        cursor.execute(
-            "INSERT INTO user_configs (user_id) VALUES (?)",
-            (user_id,)
-        )
-        return user_id
+        return cursor.lastrowid
 
 def get_user_by_username(username: str) -> dict | None:
-    with get_db() as conn:
+    with get_db_ro() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
         row = cursor.fetchone()
         return dict(row) if row else None
 
 def get_user_by_id(user_id: int) -> dict | None:
-    with get_db() as conn:
+    with get_db_ro() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
         row = cursor.fetchone()
         return dict(row) if row else None
 
-def create_session(user_id: int, session_token: str, expires_at: datetime) -> int:
+def create_session(user_id: int, session_token: str, expires_at: int) -> int:
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute(
@@ -111,13 +168,14 @@ def create_session(user_id: int, session_token: str, expires_at: datetime) -> in
         )
         return cursor.lastrowid
 
-def get_session(session_token: str) -> dict | None:
-    with get_db() as conn:
+def get_session_with_user(session_token: str) -> dict | None:
+    with get_db_ro() as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM sessions WHERE session_token = ? AND expires_at > datetime('now')",
-            (session_token,)
-        )
+        cursor.execute("""
+            SELECT u.id AS user_id, u.username, s.expires_at FROM sessions s
+            JOIN users u ON u.id = s.user_id
+            WHERE s.session_token = ? AND s.expires_at > ?
+        """, (session_token, int(time.time())))
         row = cursor.fetchone()
         return dict(row) if row else None
 
@@ -132,42 +190,52 @@ def delete_user_sessions(user_id: int):
         cursor.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
 
 def get_user_config(user_id: int) -> dict | None:
-    with get_db() as conn:
+    with get_db_ro() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM user_configs WHERE user_id = ?", (user_id,))
         row = cursor.fetchone()
         return dict(row) if row else None
 
+USER_CONFIG_FIELDS = frozenset(['client_id', 'client_secret', 'gist_id', 'github_token', 'gist_filename', 'app_api_key', 'redirect_uri', 'validated'])
+
+# UPDATE statements keyed by the sorted field names they set, so each
+# distinct statement is built once and hits SQLite's statement cache
+_update_sql_cache: dict[tuple, str] = {}
+
+def _update_config_sql(fields: tuple) -> str:
+    sql = _update_sql_cache.get(fields)
+    if sql is None:
+        set_clause = ", ".join(f"{k} = ?" for k in fields)
+        sql = f"UPDATE user_configs SET {set_clause}, updated_at = ? WHERE user_id = ?"
+        _update_sql_cache[fields] = sql
+    return sql
+
 def update_user_config(user_id: int, **kwargs) -> bool:
-    allowed_fields = ['client_id', 'client_secret', 'gist_id', 'github_token', 'gist_filename', 'app_api_key', 'redirect_uri', 'validated']
-    updates = {k: v for k, v in kwargs.items() if k in allowed_fields}
+    fields = tuple(sorted(k for k in kwargs if k in USER_CONFIG_FIELDS))
     
-    if not updates:
+    if not fields:
         return False
     
-    updates['updated_at'] = datetime.now()
-    set_clause = ", ".join(f"{k} = ?" for k in updates.keys())
-    values = list(updates.values()) + [user_id]
+    values = [kwargs[k] for k in fields]
+    values.append(datetime.now())
+    values.append(user_id)
     
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            f"UPDATE user_configs SET {set_clause} WHERE user_id = ?",
-            values
-        )
+        cursor.execute(_update_config_sql(fields), values)
         return cursor.rowcount > 0
 
 def cleanup_expired_sessions():
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM sessions WHERE expires_at <= datetime('now')")
+        cursor.execute("DELETE FROM sessions WHERE expires_at <= ?", (int(time.time()),))
         return cursor.rowcount
 
 def get_user_by_api_key(api_key: str) -> dict | None:
     """Get user by their API key"""
     if not api_key:
         return None
-    with get_db() as conn:
+    with get_db_ro() as conn:
         cursor = conn.cursor()
         cursor.execute("""
             SELECT u.id, u.username FROM users u
@@ -176,5 +244,3 @@ def get_user_by_api_key(api_key: str) -> dict | None:
         """, (api_key,))
         row = cursor.fetchone()
         return dict(row) if row else None
-
-init_db()
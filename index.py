@@ -1,24 +1,131 @@
 from fastapi import FastAPI, HTTPException, Header, Depends, Request, Response, Cookie
 from fastapi.responses import FileResponse, RedirectResponse, HTMLResponse, JSONResponse
+from fastapi.staticfiles import StaticFiles
 from urllib.parse import quote
 from pydantic import BaseModel
-import requests
-import os, json, time, base64, secrets
+from contextlib import asynccontextmanager
+from functools import lru_cache
+import httpx
+import orjson
+import os, time, base64, asyncio, threading, queue, logging, logging.handlers
+from collections import OrderedDict, defaultdict
 from dotenv import load_dotenv
 
 load_dotenv()
 
 import database
 import auth as auth_module
+from cache import TTLCache
+from throttle import TokenBucket
 
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
-app = FastAPI()
+# Log records are queued by request handlers and written by a listener thread
+logger = logging.getLogger("spofy")
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+logger.propagate = False
+_log_queue = queue.Queue(-1)
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+
+# Outbound calls are paced per host and tenant (calls/second, burst) to stay clear
+# of Spotify and GitHub rate limits, which apply per app and per GitHub token; a 429
+# holds only that tenant for its Retry-After. Idle buckets are dropped.
+OUTBOUND_LIMITS = {
+    "api.spotify.com": (20, 40),
+    "accounts.spotify.com": (5, 10),
+    "api.github.com": (5, 10),
+}
+MAX_RETRY_AFTER = 5
+_host_buckets = TTLCache(ttl=600, maxsize=4096)
+
+def _retry_after(res) -> float:
+    try:
+        return float(res.headers.get("Retry-After", 1))
+    except ValueError:
+        return 1.0
+
+def _tenant_bucket(request: httpx.Request):
+    """Bucket for the request's host and tenant: the Spotify client_id passed in
+    extensions, otherwise the Authorization header (client credentials, GitHub token)"""
+    limits = OUTBOUND_LIMITS.get(request.url.host)
+    if not limits:
+        return None
+    tenant = request.extensions.get("tenant") or request.headers.get("Authorization", "")
+    key = (request.url.host, tenant)
+    bucket = _host_buckets.get(key) or TokenBucket(*limits)
+    # Re-set on every use so only idle buckets expire
+    _host_buckets.set(key, bucket)
+    return bucket
+
+async def _throttle_request(request: httpx.Request):
+    bucket = _tenant_bucket(request)
+    if bucket:
+        await bucket.acquire()
+
+async def _note_rate_limit(response: httpx.Response):
+    if response.status_code == 429:
+        bucket = _tenant_bucket(response.request)
+        if bucket:
+            bucket.pause(min(_retry_after(response), MAX_RETRY_AFTER))
+
+# Shared client so Spotify/GitHub connections are kept alive between requests;
+# HTTP/2 lets concurrent calls share one connection, and failed connection
+# attempts are retried before surfacing an error
+http_client = httpx.AsyncClient(
+    timeout=10,
+    event_hooks={"request": [_throttle_request], "response": [_note_rate_limit]},
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    ),
+)
 
-limiter = Limiter(key_func=get_remote_address)
+# Optional Redis for state shared across workers (REDIS_URL); without it
+# everything stays in process and the app must run as a single worker
+REDIS_URL = os.getenv("REDIS_URL")
+redis_client = None
+if REDIS_URL:
+    import redis.asyncio as redis
+    redis_client = redis.from_url(REDIS_URL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    _log_listener.start()
+    # Schema setup runs here once per worker instead of at import time;
+    # get_connection() still falls back to it lazily
+    database.init_db()
+    refresher = asyncio.create_task(token_refresher())
+    yield
+    refresher.cancel()
+    await http_client.aclose()
+    if redis_client:
+        await redis_client.aclose()
+    _log_listener.stop()
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson instead of the stdlib encoder"""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# Limits are shared across workers when REDIS_URL is set, per process otherwise.
+# slowapi talks to Redis synchronously, so each limited request does one blocking
+# round trip; if Redis is unreachable it falls back to per-process limits
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri=REDIS_URL or "memory://",
+    in_memory_fallback_enabled=bool(REDIS_URL),
+)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
@@ -42,8 +149,81 @@ app.add_middleware(
     allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["X-API-Key", "Content-Type"],
 )
-
-oauth_pending_states: dict = {}
+# /queue and the HTML/JS/CSS pages compress well; small /current polls stay uncompressed
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+# In-memory OAuth states (no Redis), in insertion order so expired ones are always at the front
+OAUTH_STATE_TTL = 600
+OAUTH_STATE_MAX = 10_000
+oauth_pending_states: "OrderedDict[str, dict]" = OrderedDict()
+_oauth_lock = threading.Lock()
+
+async def put_oauth_state(state: str, user_id: int):
+    data = {"time": time.time(), "user_id": user_id}
+    if redis_client:
+        await redis_client.set(f"oauth:{state}", orjson.dumps(data), ex=OAUTH_STATE_TTL)
+        return
+    now = data["time"]
+    with _oauth_lock:
+        # Clean up old states, stopping at the first live one
+        while oauth_pending_states:
+            oldest = next(iter(oauth_pending_states.values()))
+            if now - oldest["time"] <= OAUTH_STATE_TTL and len(oauth_pending_states) < OAUTH_STATE_MAX:
+                break
+            oauth_pending_states.popitem(last=False)
+        oauth_pending_states[state] = data
+
+async def take_oauth_state(state: str):
+    """Remove and return the data stored for state, or None; each state is single-use"""
+    if redis_client:
+        raw = await redis_client.getdel(f"oauth:{state}")
+        return orjson.loads(raw) if raw else None
+    with _oauth_lock:
+        return oauth_pending_states.pop(state, None)
+
+# Gist tokens keyed by (gist_id, gist_filename); saves and renewals write through.
+# Entries live between TOKEN_CACHE_MIN_TTL and TOKEN_CACHE_TTL seconds,
+# expiring a minute before the 5-minute renewal window opens.
+TOKEN_CACHE_TTL = 300
+TOKEN_CACHE_MIN_TTL = 30
+_token_cache = TTLCache(ttl=TOKEN_CACHE_TTL)
+# Last seen Gist ETag and the tokens it carried, so re-reads after the TTL
+# entry lapses can be conditional and a 304 skips the download and parse
+_gist_etags = TTLCache(ttl=3600, maxsize=4096)
+# One renewal at a time per Gist; waiters pick up the renewed token from _token_cache
+_refresh_locks: dict = defaultdict(asyncio.Lock)
+# Configs of Gists used in the last hour; the background refresher renews
+# their tokens TOKEN_REFRESH_AHEAD seconds before expiry so requests don't wait
+TOKEN_REFRESH_AHEAD = 600
+TOKEN_REFRESH_INTERVAL = 60
+_active_gists = TTLCache(ttl=3600, maxsize=4096)
+
+# Track id last reported by /current per user, so /like and /dislike can skip
+# /me/player and the next /current can prefetch its liked state
+NOW_PLAYING_TTL = 5
+_now_playing_cache = TTLCache(ttl=NOW_PLAYING_TTL)
+
+# Whole /current responses per user, absorbing polling bursts; playback changes drop them
+CURRENT_CACHE_TTL = 1
+_current_cache = TTLCache(ttl=CURRENT_CACHE_TTL, maxsize=4096)
+
+# Liked state per (user id, track id); /like and /dislike write through
+LIKED_CACHE_TTL = 60
+_liked_cache = TTLCache(ttl=LIKED_CACHE_TTL, maxsize=4096)
+
+# In-flight /me/player fetches per user, so concurrent callers share one upstream call
+_player_inflight: dict = {}
+
+def playback_changed(user_id: int, track_changed: bool = False):
+    _current_cache.pop(user_id)
+    _player_inflight.pop(user_id, None)
+    if track_changed:
+        _now_playing_cache.pop(user_id)
+
+# get_user_config results per user id; every config write goes through update_user_config.
+# Only used in single-worker mode: with REDIS_URL another worker may have written the config
+CONFIG_CACHE_TTL = 60
+_config_cache = TTLCache(ttl=CONFIG_CACHE_TTL, maxsize=4096)
 
 # ======================= Pydantic Models =======================
 class RegisterRequest(BaseModel):
@@ -78,9 +258,12 @@ def require_auth(session_token: str = Cookie(None, alias="session_token")):
 
 def get_user_config(user_id: int) -> dict:
     """Get user's Spotify/Gist configuration"""
+    cached = None if redis_client else _config_cache.get(user_id)
+    if cached:
+        return cached
     config = database.get_user_config(user_id)
     if config:
-        return {
+        config = {
             "client_id": config.get("client_id", ""),
             "client_secret": config.get("client_secret", ""),
             "gist_id": config.get("gist_id", ""),
@@ -90,27 +273,96 @@ def get_user_config(user_id: int) -> dict:
             "redirect_uri": config.get("redirect_uri", ""),
             "validated": config.get("validated", 0)
         }
+        if not redis_client:
+            _config_cache.set(user_id, config)
+        return config
     return None
 
+def update_user_config(user_id: int, **fields):
+    """Write config fields and drop the user's cached config"""
+    database.update_user_config(user_id, **fields)
+    _config_cache.pop(user_id)
+
 async def verify_api_key(request: Request, x_api_key: str = Header(None), session_token: str = Cookie(None, alias="session_token")):
     """Verify session or API key (URL param or header)"""
     # Check session first
     user = get_current_user(session_token)
-    if user:
-        return {"user": user, "via": "session"}
-    
-    # Check API key from URL param or header
-    api_key = request.query_params.get("api_key") or x_api_key
-    if api_key:
-        user = database.get_user_by_api_key(api_key)
-        if user:
-            return {"user": user, "via": "api_key"}
-    
-    raise HTTPException(status_code=401, detail="Authentication required")
+    via = "session"
+    if not user:
+        # Check API key from URL param or header
+        api_key = request.query_params.get("api_key") or x_api_key
+        user = database.get_user_by_api_key(api_key) if api_key else None
+        via = "api_key"
+    if not user:
+        raise HTTPException(status_code=401, detail="Authentication required")
+
+    return {"user": user, "via": via, "config": get_user_config(user["id"])}
+
+
+@lru_cache(maxsize=256)
+def _spotify_token_headers(client_id: str, client_secret: str) -> dict:
+    """Headers for accounts.spotify.com/api/token, built once per credential pair"""
+    auth_header = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+    return {
+        "Authorization": f"Basic {auth_header}",
+        "Content-Type": "application/x-www-form-urlencoded",
+    }
+
+@lru_cache(maxsize=256)
+def _gist_headers(github_token: str) -> dict:
+    """Headers for the GitHub Gist API, built once per token"""
+    return {
+        "Authorization": f"token {github_token}",
+        "Content-Type": "application/json",
+        "Accept": "application/vnd.github+json",
+    }
+
+@lru_cache(maxsize=256)
+def _bearer_headers(access_token: str) -> dict:
+    """Headers for api.spotify.com, built once per access token"""
+    return {"Authorization": f"Bearer {access_token}"}
+
+SPOTIFY_SCOPES = "user-read-playback-state user-modify-playback-state user-read-currently-playing user-library-read user-library-modify"
 
+@lru_cache(maxsize=256)
+def _authorize_url_prefix(client_id: str, redirect_uri: str) -> str:
+    """Spotify authorize URL without the per-login state, encoded once per app"""
+    return (
+        f"https://accounts.spotify.com/authorize?response_type=code"
+        f"&client_id={client_id}"
+        f"&scope={quote(SPOTIFY_SCOPES)}"
+        f"&redirect_uri={quote(redirect_uri)}"
+    )
+
+def _token_cache_key(config: dict) -> tuple:
+    return (config.get("gist_id"), config.get("gist_filename") or "spotify_tokens.json")
+
+def _store_tokens(config: dict, tokens: dict):
+    remaining = tokens.get("expires_at", 0) - time.time()
+    ttl = min(TOKEN_CACHE_TTL, max(TOKEN_CACHE_MIN_TTL, remaining - 360))
+    # The deadline is kept on the monotonic clock so freshness checks ignore wall-clock jumps
+    _token_cache.set(_token_cache_key(config), {**tokens, "expires_mono": time.monotonic() + remaining}, ttl=ttl)
 
-def load_token_from_gist_for_user(user_id: int = None, config: dict = None) -> dict:
-    """Load tokens from Gist - requires user config"""
+def _is_fresh(tokens: dict) -> bool:
+    """Usable without renewal: more than 5 minutes left"""
+    return bool(tokens) and time.monotonic() < tokens.get("expires_mono", 0) - 300
+
+def _cache_tokens(config: dict, access_token: str, refresh_token: str, expires_at: float):
+    _store_tokens(config, {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "expires_at": expires_at,
+    })
+
+def _remember_gist_etag(config: dict, res, tokens: dict):
+    etag = res.headers.get("ETag")
+    if etag:
+        _gist_etags.set(_token_cache_key(config), (etag, tokens))
+    else:
+        _gist_etags.pop(_token_cache_key(config))
+
+async def load_token_from_gist_for_user(user_id: int = None, config: dict = None, force: bool = False) -> dict:
+    """Load tokens from Gist - requires user config; force skips the in-memory copy"""
     if not config:
         return {"access_token": "", "refresh_token": "", "expires_at": 0}
     
@@ -121,23 +373,38 @@ def load_token_from_gist_for_user(user_id: int = None, config: dict = None) -> d
     if not gist_id or not github_token:
         return {"access_token": "", "refresh_token": "", "expires_at": 0}
 
+    # Serve from memory unless the token is close to expiry, so a renewal
+    # done by another worker is picked up from the Gist
+    cached = None if force else _token_cache.get(_token_cache_key(config))
+    if _is_fresh(cached):
+        return cached
+
     url = f"https://api.github.com/gists/{gist_id}"
-    headers = {"Authorization": f"token {github_token}"}
+    headers = _gist_headers(github_token)
+    known = _gist_etags.get(_token_cache_key(config))
+    if known:
+        headers = {**headers, "If-None-Match": known[0]}
     try:
-        res = requests.get(url, headers=headers, timeout=10)
+        res = await http_client.get(url, headers=headers)
+        if res.status_code == 304 and known:
+            _store_tokens(config, known[1])
+            return known[1]
         if res.status_code == 200:
-            data = res.json()
+            data = orjson.loads(res.content)
             if gist_filename in data["files"]:
                 content = data["files"][gist_filename]["content"]
-                return json.loads(content)
+                tokens = orjson.loads(content)
+                _store_tokens(config, tokens)
+                _remember_gist_etag(config, res, tokens)
+                return tokens
     except Exception as e:
-        print(f"[ERROR] Load Gist failed: {e}")
+        logger.error("Load Gist failed: %s", e)
     return {"access_token": "", "refresh_token": "", "expires_at": 0}
 
-def save_token_to_gist(access_token: str, refresh_token: str, expires_at: float, config: dict = None):
+async def save_token_to_gist(access_token: str, refresh_token: str, expires_at: float, config: dict = None):
     """Save tokens to Gist - requires user config"""
     if not config:
-        print("[WARN] No config provided")
+        logger.warning("No config provided")
         return False
     
     gist_id = config.get("gist_id")
@@ -145,39 +412,31 @@ def save_token_to_gist(access_token: str, refresh_token: str, expires_at: float,
     gist_filename = config.get("gist_filename") or "spotify_tokens.json"
     
     if not gist_id or not github_token:
-        print("[WARN] Gist not configured")
+        logger.warning("Gist not configured")
         return False
 
     url = f"https://api.github.com/gists/{gist_id}"
-    headers = {
-        "Authorization": f"token {github_token}",
-        "Content-Type": "application/json",
-        "Accept": "application/vnd.github+json",
-    }
-    data = {
-        "files": {
-            gist_filename: {
-                "content": json.dumps(
-                    {
-                        "access_token": access_token,
-                        "refresh_token": refresh_token,
-                        "expires_at": expires_at,
-                    },
-                    indent=2,
-                )
-            }
-        }
+    headers = _gist_headers(github_token)
+    tokens = {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "expires_at": expires_at,
     }
+    data = {"files": {gist_filename: {"content": orjson.dumps(tokens).decode()}}}
 
     try:
-        res = requests.patch(url, headers=headers, json=data, timeout=10)
-        print(f"[DEBUG] Gist save status: {res.status_code}")
-        return res.status_code == 200
+        res = await http_client.patch(url, headers=headers, content=orjson.dumps(data))
+        logger.debug("Gist save status: %s", res.status_code)
+        if res.status_code == 200:
+            _store_tokens(config, tokens)
+            _remember_gist_etag(config, res, tokens)
+            return True
+        return False
     except Exception as e:
-        print(f"[ERROR] Save Gist failed: {e}")
+        logger.error("Save Gist failed: %s", e)
         return False
 
-def renew_access_token(refresh_token: str, config: dict = None):
+async def renew_access_token(refresh_token: str, config: dict = None):
     """Renew access token using refresh token - requires config"""
     if not config:
         return None
@@ -189,30 +448,34 @@ def renew_access_token(refresh_token: str, config: dict = None):
         return None
     
     url = "https://accounts.spotify.com/api/token"
-    auth_header = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
-    headers = {
-        "Authorization": f"Basic {auth_header}",
-        "Content-Type": "application/x-www-form-urlencoded",
-    }
+    headers = _spotify_token_headers(client_id, client_secret)
     data = {"grant_type": "refresh_token", "refresh_token": refresh_token}
 
-    res = requests.post(url, headers=headers, data=data, timeout=10)
-    print(f"[DEBUG] Renew status: {res.status_code}")
+    res = await http_client.post(url, headers=headers, data=data)
+    logger.debug("Renew status: %s", res.status_code)
 
     if res.status_code == 200:
-        token_data = res.json()
+        token_data = orjson.loads(res.content)
         access_token = token_data["access_token"]
         new_refresh_token = token_data.get("refresh_token", refresh_token)
         expires_at = time.time() + token_data.get("expires_in", 3600)
-        save_token_to_gist(access_token, new_refresh_token, expires_at, config)
+        # Keep using the new token in-process even if the Gist write fails
+        _cache_tokens(config, access_token, new_refresh_token, expires_at)
+        await save_token_to_gist(access_token, new_refresh_token, expires_at, config)
         return token_data
     else:
-        print(f"[ERROR] Renew failed: {res.text[:200]}")
+        logger.error("Renew failed: %s", res.text[:200])
         return None
 
-def get_valid_token(config: dict = None) -> str:
+async def get_valid_token(config: dict = None) -> str:
     """Get valid Spotify token, refreshing if needed"""
-    cached = load_token_from_gist_for_user(config=config)
+    if config:
+        cached = _token_cache.get(_token_cache_key(config))
+        if _is_fresh(cached) and cached.get("access_token") and cached.get("refresh_token"):
+            return cached["access_token"]
+        _active_gists.set(_token_cache_key(config), config)
+
+    cached = await load_token_from_gist_for_user(config=config)
     access_token = cached.get("access_token", "")
     refresh_token = cached.get("refresh_token", "")
     expires_at = cached.get("expires_at", 0)
@@ -224,8 +487,13 @@ def get_valid_token(config: dict = None) -> str:
         raise HTTPException(status_code=400, detail="No refresh_token in Gist")
 
     if time.time() >= expires_at - 300:
-        print(f"[DEBUG] Token expires in {int(expires_at - time.time())}s, renewing...")
-        token_data = renew_access_token(refresh_token, config)
+        key = _token_cache_key(config)
+        async with _refresh_locks[key]:
+            fresh = _token_cache.get(key)
+            if _is_fresh(fresh):
+                return fresh["access_token"]
+            logger.debug("Token expires in %ds, renewing...", expires_at - time.time())
+            token_data = await renew_access_token(refresh_token, config)
         if token_data:
             return token_data["access_token"]
         else:
@@ -233,25 +501,82 @@ def get_valid_token(config: dict = None) -> str:
 
     return access_token
 
-def spotify_request(method, endpoint, access_token, config: dict = None, **kwargs):
+async def spotify_request(method, endpoint, access_token, config: dict = None, **kwargs):
     url = f"https://api.spotify.com/v1{endpoint}"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    res = requests.request(method, url, headers=headers, timeout=10, **kwargs)
+    if config:
+        # Throttled per Spotify app rather than per access token
+        kwargs["extensions"] = {"tenant": config.get("client_id")}
+    res = await http_client.request(method, url, headers=_bearer_headers(access_token), **kwargs)
+
+    if res.status_code == 429 and _retry_after(res) <= MAX_RETRY_AFTER:
+        # The host bucket is paused for Retry-After, so this waits before resending
+        logger.warning("Spotify rate limited %s %s, retrying", method, endpoint)
+        res = await http_client.request(method, url, headers=_bearer_headers(access_token), **kwargs)
     
     if res.status_code == 401:
-        print("[DEBUG] Got 401, retrying with fresh token...")
-        cached = load_token_from_gist_for_user(config=config)
-        token_data = renew_access_token(cached.get("refresh_token", ""), config)
-        if token_data:
-            headers["Authorization"] = f"Bearer {token_data['access_token']}"
-            res = requests.request(method, url, headers=headers, timeout=10, **kwargs)
+        logger.debug("Got 401, retrying with fresh token...")
+        new_token = await renew_rejected_token(access_token, config)
+        if new_token:
+            res = await http_client.request(method, url, headers=_bearer_headers(new_token), **kwargs)
     
     return res
 
+async def renew_rejected_token(rejected_token: str, config: dict = None):
+    """Replacement for a token Spotify answered 401 to, renewing at most once per Gist"""
+    if not config:
+        return None
+    key = _token_cache_key(config)
+    async with _refresh_locks[key]:
+        cached = _token_cache.get(key)
+        if cached and cached.get("access_token") != rejected_token:
+            # Another request renewed it while we waited
+            return cached["access_token"]
+        if not cached:
+            cached = await load_token_from_gist_for_user(config=config)
+        if not cached.get("refresh_token"):
+            # Nothing to renew with (Gist unreadable or empty); don't spend an accounts call
+            _token_cache.pop(key)
+            return None
+        token_data = await renew_access_token(cached["refresh_token"], config)
+    if token_data:
+        return token_data["access_token"]
+    # Re-read the Gist next time in case another worker rotated the tokens
+    _token_cache.pop(key)
+    return None
+
+async def refresh_expiring_tokens():
+    """Renew tokens of recently used Gists that expire within TOKEN_REFRESH_AHEAD seconds"""
+    for key, config in _active_gists.items():
+        cached = _token_cache.get(key)
+        if cached and time.monotonic() < cached.get("expires_mono", 0) - TOKEN_REFRESH_AHEAD:
+            continue
+        try:
+            async with _refresh_locks[key]:
+                # Conditional Gist read, so a renewal by another worker is seen.
+                # A failed read, or a Gist older than our copy (its write failed
+                # after a renewal), leaves the in-memory tokens in place
+                held = _token_cache.get(key)
+                tokens = await load_token_from_gist_for_user(config=config, force=True)
+                if held and held.get("expires_at", 0) > tokens.get("expires_at", 0):
+                    _store_tokens(config, held)
+                    tokens = held
+                if not tokens.get("refresh_token") or time.time() < tokens.get("expires_at", 0) - TOKEN_REFRESH_AHEAD:
+                    continue
+                logger.debug("Token expires in %ds, renewing in background", tokens.get("expires_at", 0) - time.time())
+                if not await renew_access_token(tokens["refresh_token"], config):
+                    logger.warning("Background renewal failed for gist %s", key[0])
+        except Exception as e:
+            logger.error("Background renewal failed: %s", e)
+
+async def token_refresher():
+    while True:
+        await asyncio.sleep(TOKEN_REFRESH_INTERVAL)
+        await refresh_expiring_tokens()
+
 def handle_spotify_error(res):
     if res.status_code in [200, 204]:
         return
-    print(f"[ERROR] Spotify API {res.status_code}: {res.text}")
+    logger.error("Spotify API %s: %s", res.status_code, res.text)
     detail = "An error occurred with the music player service."
     if res.status_code == 403:
         detail = "Action forbidden."
@@ -259,46 +584,64 @@ def handle_spotify_error(res):
         detail = "Resource not found."
     elif res.status_code == 401:
         detail = "Authentication failed."
+    elif res.status_code == 429:
+        detail = "Too many requests, try again shortly."
     raise HTTPException(status_code=res.status_code, detail=detail)
 
-def parse_time(ms: int):
-    minutes = int(ms / 60000)
-    seconds = int((ms % 60000) / 1000)
-    return f"{minutes:02}:{seconds:02}"
+# Shared read-only fallback for missing nested objects; never mutate it
+_EMPTY: dict = {}
+
+def _pick_thumb(images: list) -> str:
+    """Medium-size album art when available, else the only image"""
+    return images[1]["url"] if len(images) > 1 else images[0]["url"] if images else ""
+
+def _join_artists(artists: list) -> str:
+    return ", ".join([a["name"] for a in artists])
+
+def _format_track(item: dict, index: int = None) -> dict:
+    """Summary of a track object as listed by /queue"""
+    album = item.get("album") or _EMPTY
+    track = {} if index is None else {"index": index}
+    track["track"] = item.get("name", "")
+    track["artist"] = _join_artists(item.get("artists") or ())
+    track["album"] = album.get("name", "")
+    track["thumbnail"] = _pick_thumb(album.get("images") or ())
+    track["id"] = item.get("id", "")
+    return track
 
 def parse_track_data(data: dict):
     if not data or not data.get("item"):
         return {"is_playing": False, "message": "No active playback"}
 
     item = data["item"]
-    album = item.get("album", {})
-    images = album.get("images", [])
-    thumbnail = images[1]["url"] if len(images) > 1 else (images[0]["url"] if images else "")
-    
-    progress_ms = data.get("progress_ms", 0)
-    duration_ms = item.get("duration_ms", 0)
-    progress_percent = (progress_ms / duration_ms * 100) if duration_ms else 0
+    album = item.get("album") or _EMPTY
+    device = data.get("device") or _EMPTY
+    progress_ms = data.get("progress_ms") or 0
+    duration_ms = item.get("duration_ms") or 0
+    progress_min, progress_sec = divmod(progress_ms // 1000, 60)
+    duration_min, duration_sec = divmod(duration_ms // 1000, 60)
 
     return {
         "is_playing": data.get("is_playing", False),
         "track": item.get("name", ""),
-        "artist": ", ".join(a["name"] for a in item.get("artists", [])),
+        "artist": _join_artists(item.get("artists") or ()),
         "album": album.get("name", ""),
-        "thumbnail": thumbnail,
+        "thumbnail": _pick_thumb(album.get("images") or ()),
         "duration_ms": duration_ms,
         "progress_ms": progress_ms,
-        "progress_percent": round(progress_percent, 2),
-        "progress": f"{parse_time(progress_ms)} / {parse_time(duration_ms)}",
-        "device": data.get("device", {}).get("name", ""),
-        "volume_percent": data.get("device", {}).get("volume_percent"),
+        "progress_percent": round(progress_ms / duration_ms * 100, 2) if duration_ms else 0,
+        "progress": f"{progress_min:02}:{progress_sec:02} / {duration_min:02}:{duration_sec:02}",
+        "device": device.get("name", ""),
+        "volume_percent": device.get("volume_percent"),
         "shuffle_state": data.get("shuffle_state", False),
         "repeat_state": data.get("repeat_state", "off"),
         "track_id": item.get("id"),
+        "context_uri": (data.get("context") or _EMPTY).get("uri"),
     }
 
 # ======================= Auth Routes =======================
 @app.get("/")
-def serve_root(session_token: str = Cookie(None, alias="session_token")):
+async def serve_root(session_token: str = Cookie(None, alias="session_token")):
     """Root route - redirect based on auth state"""
     user = get_current_user(session_token)
     if not user:
@@ -313,37 +656,39 @@ def serve_root(session_token: str = Cookie(None, alias="session_token")):
     if not config.get("validated"):
         return RedirectResponse("/setup")
     
-    # Check if has valid tokens
-    try:
-        cached = load_token_from_gist_for_user(config=config)
-        if not cached.get("access_token") or not cached.get("refresh_token"):
+    # Check if has tokens; any cached pair will do, renewal is get_valid_token's job
+    cached = _token_cache.get(_token_cache_key(config))
+    if not cached:
+        try:
+            cached = await load_token_from_gist_for_user(config=config)
+        except Exception:
             return RedirectResponse("/spotify/login")
-    except Exception:
+    if not cached.get("access_token") or not cached.get("refresh_token"):
         return RedirectResponse("/spotify/login")
     
     return FileResponse("index.html")
 
 @app.get("/welcome")
-def serve_welcome():
+async def serve_welcome():
     return FileResponse("welcome.html")
 
 @app.get("/auth/register")
-def serve_register():
+async def serve_register():
     return FileResponse("register.html")
 
 @app.get("/auth/login")
-def serve_login():
+async def serve_login():
     return FileResponse("login.html")
 
 @app.get("/setup")
-def serve_setup(session_token: str = Cookie(None, alias="session_token")):
+async def serve_setup(session_token: str = Cookie(None, alias="session_token")):
     user = get_current_user(session_token)
     if not user:
         return RedirectResponse("/auth/login")
     return FileResponse("setup.html")
 
 @app.get("/player")
-def serve_player(session_token: str = Cookie(None, alias="session_token")):
+async def serve_player(session_token: str = Cookie(None, alias="session_token")):
     """Serve player - requires auth and setup"""
     user = get_current_user(session_token)
     if not user:
@@ -357,22 +702,23 @@ def serve_player(session_token: str = Cookie(None, alias="session_token")):
 
 @app.post("/api/auth/register")
 async def api_register(request: RegisterRequest, response: Response):
-    result = auth_module.register_user(request.username, request.password)
+    # scrypt is CPU-bound; keep it off the event loop
+    result = await asyncio.to_thread(auth_module.register_user, request.username, request.password)
     
     if result.get("error"):
-        return JSONResponse({"success": False, "error": result["error"]}, status_code=400)
+        return ORJSONResponse({"success": False, "error": result["error"]}, status_code=400)
     
     return {"success": True, "message": "Đăng ký thành công!"}
 
 @app.post("/api/auth/login")
 async def api_login(request: LoginRequest, response: Response):
-    result = auth_module.login_user(request.username, request.password)
+    result = await asyncio.to_thread(auth_module.login_user, request.username, request.password)
     
     if result.get("error"):
-        return JSONResponse({"success": False, "error": result["error"]}, status_code=401)
+        return ORJSONResponse({"success": False, "error": result["error"]}, status_code=401)
     
     # Set session cookie
-    resp = JSONResponse({
+    resp = ORJSONResponse({
         "success": True,
         "user": {"id": result["user_id"], "username": result["username"]}
     })
@@ -390,7 +736,7 @@ async def api_logout(response: Response, session_token: str = Cookie(None, alias
     if session_token:
         auth_module.logout_user(session_token)
     
-    resp = JSONResponse({"success": True})
+    resp = ORJSONResponse({"success": True})
     resp.delete_cookie("session_token")
     return resp
 
@@ -429,22 +775,22 @@ async def api_save_config(config: ConfigRequest, session_token: str = Cookie(Non
     
     # Validate required fields
     if not config.client_id or not config.client_secret:
-        return JSONResponse({"success": False, "error": "Client ID và Client Secret là bắt buộc"}, status_code=400)
+        return ORJSONResponse({"success": False, "error": "Client ID và Client Secret là bắt buộc"}, status_code=400)
     
     if not config.gist_id or not config.github_token:
-        return JSONResponse({"success": False, "error": "Gist ID và GitHub Token là bắt buộc"}, status_code=400)
+        return ORJSONResponse({"success": False, "error": "Gist ID và GitHub Token là bắt buộc"}, status_code=400)
     
     # Test Gist access
     try:
         test_url = f"https://api.github.com/gists/{config.gist_id}"
-        test_res = requests.get(test_url, headers={"Authorization": f"token {config.github_token}"}, timeout=10)
+        test_res = await http_client.get(test_url, headers={"Authorization": f"token {config.github_token}"})
         if test_res.status_code != 200:
-            return JSONResponse({"success": False, "error": "Không thể truy cập Gist. Kiểm tra Gist ID và GitHub Token."}, status_code=400)
+            return ORJSONResponse({"success": False, "error": "Không thể truy cập Gist. Kiểm tra Gist ID và GitHub Token."}, status_code=400)
     except Exception as e:
-        return JSONResponse({"success": False, "error": f"Lỗi kết nối GitHub: {str(e)}"}, status_code=400)
+        return ORJSONResponse({"success": False, "error": f"Lỗi kết nối GitHub: {str(e)}"}, status_code=400)
     
     # Save config
-    database.update_user_config(
+    update_user_config(
         user_id=user["id"],
         client_id=config.client_id,
         client_secret=config.client_secret,
@@ -463,8 +809,8 @@ async def api_generate_key(session_token: str = Cookie(None, alias="session_toke
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    new_key = secrets.token_urlsafe(32)
-    database.update_user_config(user["id"], app_api_key=new_key)
+    new_key = auth_module.generate_token()
+    update_user_config(user["id"], app_api_key=new_key)
     return {"success": True, "api_key": new_key}
 
 @app.get("/api/my-api-key")
@@ -478,17 +824,46 @@ async def api_get_my_key(session_token: str = Cookie(None, alias="session_token"
     return {"api_key": config.get("app_api_key", "") if config else ""}
 
 # ======================= Static Files =======================
-@app.get("/style.css")
-def serve_css():
-    return FileResponse("style.css")
+# Assets are versioned with ?v= in index.html, so browsers may keep them for a day
+# and revalidate with ETag/Last-Modified afterwards
+STATIC_CACHE_CONTROL = "public, max-age=86400"
+
+class CachedStaticFiles(StaticFiles):
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = STATIC_CACHE_CONTROL
+        return response
 
-@app.get("/script.js")
-def serve_js():
-    return FileResponse("script.js")
+# Only the static/ directory is exposed; the app directory also holds .py, .env and the database
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
 
 # ======================= Spotify OAuth =======================
+# Callback result pages, encoded once at import
+_NO_STORE = {"Cache-Control": "no-store"}
+_OAUTH_SAVED_HTML = """
+<html>
+    <body style='background:#0a0a0a; color:#fff; font-family:Poppins,sans-serif; display:flex; flex-direction:column; align-items:center; justify-content:center; height:100vh;'>
+        <div style='text-align:center;'>
+            <svg width='64' height='64' viewBox='0 0 24 24' fill='#1ed760'><path d='M12 0C5.4 0 0 5.4 0 12s5.4 12 12 12 12-5.4 12-12S18.66 0 12 0zm5.521 17.34c-.24.359-.66.48-1.021.24-2.82-1.74-6.36-2.101-10.561-1.141-.418.122-.779-.179-.899-.539-.12-.421.18-.78.54-.9 4.56-1.021 8.52-.6 11.64 1.32.42.18.479.659.301 1.02zm1.44-3.3c-.301.42-.841.6-1.262.3-3.239-1.98-8.159-2.58-11.939-1.38-.479.12-1.02-.12-1.14-.6-.12-.48.12-1.021.6-1.141C9.6 9.9 15 10.561 18.72 12.84c.361.181.54.78.241 1.2zm.12-3.36C15.24 8.4 8.82 8.16 5.16 9.301c-.6.179-1.2-.181-1.38-.721-.18-.601.18-1.2.72-1.381 4.26-1.26 11.28-1.02 15.721 1.621.539.3.719 1.02.419 1.56-.299.421-1.02.599-1.559.3z'/></svg>
+            <h2 style='color:#1ed760; margin:24px 0 8px;'>Kết nối thành công!</h2>
+            <p style='color:#a7a7a7; margin-bottom:24px;'>Tokens đã được lưu vào Gist của bạn.</p>
+            <a href='/' style='display:inline-block; background:#1ed760; color:#000; padding:14px 32px; border-radius:50px; text-decoration:none; font-weight:600;'>Bắt đầu nghe nhạc</a>
+        </div>
+    </body>
+</html>
+""".encode()
+_OAUTH_SAVE_FAILED_HTML = """
+<html>
+    <body style='background:#0a0a0a; color:#fff; font-family:Poppins,sans-serif; display:flex; flex-direction:column; align-items:center; justify-content:center; height:100vh;'>
+        <h2 style='color:#f44336;'>Lỗi lưu tokens</h2>
+        <p style='color:#a7a7a7;'>Không thể lưu tokens vào Gist. Kiểm tra cấu hình GitHub.</p>
+        <a href='/setup' style='color:#1ed760;'>Quay lại cài đặt</a>
+    </body>
+</html>
+""".encode()
+
 @app.get("/spotify/login")
-def spotify_login(session_token: str = Cookie(None, alias="session_token")):
+async def spotify_login(session_token: str = Cookie(None, alias="session_token")):
     """Initiate Spotify OAuth - requires user to be logged in"""
     user = get_current_user(session_token)
     if not user:
@@ -501,38 +876,22 @@ def spotify_login(session_token: str = Cookie(None, alias="session_token")):
     client_id = config["client_id"]
     redirect_uri = config.get("redirect_uri") or (f"https://100.53.0.184.nip.io/api/spotify/callback" if ENVIRONMENT == "production" else f"http://127.0.0.1:8000/api/spotify/callback")
     
-    state = secrets.token_urlsafe(32)
-    oauth_pending_states[state] = {"time": time.time(), "user_id": user["id"]}
+    state = auth_module.generate_token()
+    await put_oauth_state(state, user["id"])
     
-    # Clean up old states
-    current_time = time.time()
-    expired_states = [s for s, data in oauth_pending_states.items() if current_time - data.get("time", 0) > 600]
-    for s in expired_states:
-        del oauth_pending_states[s]
-    
-    scopes = "user-read-playback-state user-modify-playback-state user-read-currently-playing user-library-read user-library-modify"
-    auth_url = (
-        f"https://accounts.spotify.com/authorize?response_type=code"
-        f"&client_id={client_id}"
-        f"&scope={quote(scopes)}"
-        f"&redirect_uri={quote(redirect_uri)}"
-        f"&state={state}"
-    )
-    return RedirectResponse(auth_url)
+    return RedirectResponse(_authorize_url_prefix(client_id, redirect_uri) + "&state=" + state)
 
 @app.get("/api/spotify/callback")
-def spotify_callback(code: str, state: str = None, session_token: str = Cookie(None, alias="session_token")):
+async def spotify_callback(code: str, state: str = None, session_token: str = Cookie(None, alias="session_token")):
     """Handle Spotify OAuth callback"""
-    if not state or state not in oauth_pending_states:
+    state_data = await take_oauth_state(state) if state else None
+    if not state_data:
         raise HTTPException(status_code=400, detail="Invalid or missing state parameter")
     
-    state_data = oauth_pending_states.get(state, {})
     if time.time() - state_data.get("time", 0) > 300:
-        del oauth_pending_states[state]
         raise HTTPException(status_code=400, detail="Authentication session expired. Please try again.")
     
     user_id = state_data.get("user_id")
-    del oauth_pending_states[state]
     
     if not user_id:
         raise HTTPException(status_code=400, detail="Invalid session")
@@ -546,58 +905,35 @@ def spotify_callback(code: str, state: str = None, session_token: str = Cookie(N
     redirect_uri = config.get("redirect_uri") or (f"https://100.53.0.184.nip.io/api/spotify/callback" if ENVIRONMENT == "production" else f"http://127.0.0.1:8000/api/spotify/callback")
     
     url = "https://accounts.spotify.com/api/token"
-    auth_header = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
-    headers = {
-        "Authorization": f"Basic {auth_header}",
-        "Content-Type": "application/x-www-form-urlencoded",
-    }
+    headers = _spotify_token_headers(client_id, client_secret)
     data = {
         "grant_type": "authorization_code",
         "code": code,
         "redirect_uri": redirect_uri,
     }
 
-    res = requests.post(url, headers=headers, data=data, timeout=10)
+    res = await http_client.post(url, headers=headers, data=data)
     
     if res.status_code == 200:
-        token_data = res.json()
+        token_data = orjson.loads(res.content)
         access_token = token_data["access_token"]
         refresh_token = token_data["refresh_token"]
         expires_at = time.time() + token_data.get("expires_in", 3600)
         
-        success = save_token_to_gist(access_token, refresh_token, expires_at, config)
+        success = await save_token_to_gist(access_token, refresh_token, expires_at, config)
         
         if success:
             # Mark config as validated
-            database.update_user_config(user_id, validated=1)
-            return HTMLResponse("""
-                <html>
-                    <body style='background:#0a0a0a; color:#fff; font-family:Poppins,sans-serif; display:flex; flex-direction:column; align-items:center; justify-content:center; height:100vh;'>
-                        <div style='text-align:center;'>
-                            <svg width='64' height='64' viewBox='0 0 24 24' fill='#1ed760'><path d='M12 0C5.4 0 0 5.4 0 12s5.4 12 12 12 12-5.4 12-12S18.66 0 12 0zm5.521 17.34c-.24.359-.66.48-1.021.24-2.82-1.74-6.36-2.101-10.561-1.141-.418.122-.779-.179-.899-.539-.12-.421.18-.78.54-.9 4.56-1.021 8.52-.6 11.64 1.32.42.18.479.659.301 1.02zm1.44-3.3c-.301.42-.841.6-1.262.3-3.239-1.98-8.159-2.58-11.939-1.38-.479.12-1.02-.12-1.14-.6-.12-.48.12-1.021.6-1.141C9.6 9.9 15 10.561 18.72 12.84c.361.181.54.78.241 1.2zm.12-3.36C15.24 8.4 8.82 8.16 5.16 9.301c-.6.179-1.2-.181-1.38-.721-.18-.601.18-1.2.72-1.381 4.26-1.26 11.28-1.02 15.721 1.621.539.3.719 1.02.419 1.56-.299.421-1.02.599-1.559.3z'/></svg>
-                            <h2 style='color:#1ed760; margin:24px 0 8px;'>Kết nối thành công!</h2>
-                            <p style='color:#a7a7a7; margin-bottom:24px;'>Tokens đã được lưu vào Gist của bạn.</p>
-                            <a href='/' style='display:inline-block; background:#1ed760; color:#000; padding:14px 32px; border-radius:50px; text-decoration:none; font-weight:600;'>Bắt đầu nghe nhạc</a>
-                        </div>
-                    </body>
-                </html>
-            """)
+            update_user_config(user_id, validated=1)
+            return HTMLResponse(_OAUTH_SAVED_HTML, headers=_NO_STORE)
         else:
-            return HTMLResponse("""
-                <html>
-                    <body style='background:#0a0a0a; color:#fff; font-family:Poppins,sans-serif; display:flex; flex-direction:column; align-items:center; justify-content:center; height:100vh;'>
-                        <h2 style='color:#f44336;'>Lỗi lưu tokens</h2>
-                        <p style='color:#a7a7a7;'>Không thể lưu tokens vào Gist. Kiểm tra cấu hình GitHub.</p>
-                        <a href='/setup' style='color:#1ed760;'>Quay lại cài đặt</a>
-                    </body>
-                </html>
-            """, status_code=500)
+            return HTMLResponse(_OAUTH_SAVE_FAILED_HTML, status_code=500, headers=_NO_STORE)
     else:
         error_text = res.text[:200] if res.text else ""
-        print(f"[ERROR] OAuth token exchange failed: {res.status_code} - {error_text}")
+        logger.error("OAuth token exchange failed: %s - %s", res.status_code, error_text)
         
         # Mark config as not validated
-        database.update_user_config(user_id, validated=0)
+        update_user_config(user_id, validated=0)
         
         # Determine error type for user-friendly message
         error_param = "oauth_failed"
@@ -609,250 +945,305 @@ def spotify_callback(code: str, state: str = None, session_token: str = Cookie(N
         return RedirectResponse(f"/setup?error={error_param}")
 
 # ======================= Spotify API Endpoints =======================
-def get_user_config_from_session(session_token: str) -> dict:
-    """Helper to get user config from session"""
-    user = get_current_user(session_token)
-    if not user:
-        return None
-    return get_user_config(user["id"])
+# Fixed success bodies for the playback actions, serialized once at import
+_ACTION_RESPONSES = {
+    action: orjson.dumps({"success": True, "action": action})
+    for action in ("play", "pause", "next", "previous")
+}
+
+def action_response(action: str) -> Response:
+    return Response(_ACTION_RESPONSES[action], media_type="application/json")
+
+async def fetch_player(user_id: int, access_token: str, config: dict = None):
+    """GET /me/player, joining a fetch already in flight for the same user"""
+    task = _player_inflight.get(user_id)
+    if task is None:
+        task = asyncio.ensure_future(spotify_request("GET", "/me/player", access_token, config))
+        _player_inflight[user_id] = task
+
+        def _done(t):
+            if _player_inflight.get(user_id) is t:
+                del _player_inflight[user_id]
+        task.add_done_callback(_done)
+    # One caller disconnecting must not cancel the fetch for the others
+    return await asyncio.shield(task)
+
+async def fetch_is_liked(track_id: str, access_token: str, config: dict = None):
+    res = await spotify_request("GET", "/me/tracks/contains", access_token, config, params={"ids": track_id})
+    if res.status_code == 200:
+        return orjson.loads(res.content)[0]
+    return None
+
+async def get_is_liked(user_id: int, track_id: str, access_token: str, config: dict = None):
+    liked = _liked_cache.get((user_id, track_id))
+    if liked is None:
+        liked = await fetch_is_liked(track_id, access_token, config)
+        if liked is not None:
+            _liked_cache.set((user_id, track_id), liked)
+    return liked
 
 @app.get("/current")
 @limiter.limit("120/minute")
-def current(request: Request, auth: str = Depends(verify_api_key), session_token: str = Cookie(None, alias="session_token")):
-    config = get_user_config_from_session(session_token)
-    access_token = get_valid_token(config)
-    res = spotify_request("GET", "/me/player", access_token, config)
+async def current(request: Request, track_id: str = None, auth: str = Depends(verify_api_key)):
+    user_id = auth["user"]["id"]
+    cached = _current_cache.get(user_id)
+    if cached:
+        return ORJSONResponse(cached)
+
+    config = auth["config"]
+    access_token = await get_valid_token(config)
+    # Guess the track from the caller's hint or the last one we saw playing,
+    # and check its liked state alongside /me/player unless already cached
+    track_id = track_id or _now_playing_cache.get(user_id)
+    if track_id and _liked_cache.get((user_id, track_id)) is None:
+        res, _ = await asyncio.gather(
+            fetch_player(user_id, access_token, config),
+            get_is_liked(user_id, track_id, access_token, config),
+        )
+    else:
+        res = await fetch_player(user_id, access_token, config)
 
     if res.status_code == 200:
-        data = res.json()
+        data = orjson.loads(res.content)
         parsed = parse_track_data(data)
-        track_id = parsed.get("track_id")
-        if track_id:
-            like_res = spotify_request("GET", f"/me/tracks/contains?ids={track_id}", access_token, config)
-            if like_res.status_code == 200:
-                parsed["is_liked"] = like_res.json()[0]
-            else:
-                parsed["is_liked"] = None
-        return parsed
+        playing_id = parsed.get("track_id")
+        if playing_id:
+            _now_playing_cache.set(user_id, playing_id)
+            parsed["is_liked"] = await get_is_liked(user_id, playing_id, access_token, config)
+        _current_cache.set(user_id, parsed)
+        return ORJSONResponse(parsed)
     elif res.status_code == 204:
-        return {"is_playing": False, "message": "Nothing playing"}
+        parsed = {"is_playing": False, "message": "Nothing playing"}
+        _current_cache.set(user_id, parsed)
+        return ORJSONResponse(parsed)
     else:
         handle_spotify_error(res)
 
 @app.get("/play")
 @limiter.limit("60/minute")
-def play(request: Request, auth: str = Depends(verify_api_key), session_token: str = Cookie(None, alias="session_token")):
-    config = get_user_config_from_session(session_token)
-    access_token = get_valid_token(config)
-    res = spotify_request("PUT", "/me/player/play", access_token, config)
+async def play(request: Request, auth: str = Depends(verify_api_key)):
+    config = auth["config"]
+    access_token = await get_valid_token(config)
+    res = await spotify_request("PUT", "/me/player/play", access_token, config)
     
     if res.status_code in [204, 200]:
-        return {"success": True, "action": "play"}
+        playback_changed(auth["user"]["id"])
+        return action_response("play")
     handle_spotify_error(res)
 
 @app.get("/pause")
 @limiter.limit("60/minute")
-def pause(request: Request, auth: str = Depends(verify_api_key), session_token: str = Cookie(None, alias="session_token")):
-    config = get_user_config_from_session(session_token)
-    access_token = get_valid_token(config)
-    res = spotify_request("PUT", "/me/player/pause", access_token, config)
+async def pause(request: Request, auth: str = Depends(verify_api_key)):
+    config = auth["config"]
+    access_token = await get_valid_token(config)
+    res = await spotify_request("PUT", "/me/player/pause", access_token, config)
     
     if res.status_code in [204, 200]:
-        return {"success": True, "action": "pause"}
+        playback_changed(auth["user"]["id"])
+        return action_response("pause")
     handle_spotify_error(res)
 
 @app.get("/next")
 @limiter.limit("60/minute")
-def next_track(request: Request, auth: str = Depends(verify_api_key), session_token: str = Cookie(None, alias="session_token")):
-    config = get_user_config_from_session(session_token)
-    access_token = get_valid_token(config)
-    res = spotify_request("POST", "/me/player/next", access_token, config)
+async def next_track(request: Request, auth: str = Depends(verify_api_key)):
+    config = auth["config"]
+    access_token = await get_valid_token(config)
+    res = await spotify_request("POST", "/me/player/next", access_token, config)
     
     if res.status_code in [204, 200]:
-        return {"success": True, "action": "next"}
+        playback_changed(auth["user"]["id"], track_changed=True)
+        return action_response("next")
     handle_spotify_error(res)
 
 @app.get("/prev")
 @limiter.limit("60/minute")
-def prev_track(request: Request, auth: str = Depends(verify_api_key), session_token: str = Cookie(None, alias="session_token")):
-    config = get_user_config_from_session(session_token)
-    access_token = get_valid_token(config)
-    res = spotify_request("POST", "/me/player/previous", access_token, config)
+async def prev_track(request: Request, auth: str = Depends(verify_api_key)):
+    config = auth["config"]
+    access_token = await get_valid_token(config)
+    res = await spotify_request("POST", "/me/player/previous", access_token, config)
     
     if res.status_code in [204, 200]:
-        return {"success": True, "action": "previous"}
+        playback_changed(auth["user"]["id"], track_changed=True)
+        return action_response("previous")
     handle_spotify_error(res)
 
+async def resolve_track_id(track_id: str, user_id: int, access_token: str, config: dict = None):
+    """Track to act on: caller-supplied, else recently seen by /current, else /me/player"""
+    if track_id:
+        return track_id
+    cached = _now_playing_cache.get(user_id)
+    if cached:
+        return cached
+    current = await fetch_player(user_id, access_token, config)
+    if current.status_code == 200:
+        data = orjson.loads(current.content)
+        return (data.get("item") or {}).get("id")
+    return None
+
 @app.get("/like")
 @limiter.limit("20/minute")
-def like_track(request: Request, auth: str = Depends(verify_api_key), session_token: str = Cookie(None, alias="session_token")):
-    config = get_user_config_from_session(session_token)
-    access_token = get_valid_token(config)
-    current = spotify_request("GET", "/me/player", access_token, config)
-    if current.status_code == 200:
-        data = current.json()
-        track_id = data.get("item", {}).get("id")
-        if track_id:
-            res = spotify_request("PUT", f"/me/tracks?ids={track_id}", access_token, config)
-            if res.status_code in [200, 204]:
-                return {"success": True, "action": "liked", "track_id": track_id}
-            handle_spotify_error(res)
+async def like_track(request: Request, track_id: str = None, auth: str = Depends(verify_api_key)):
+    config = auth["config"]
+    access_token = await get_valid_token(config)
+    track_id = await resolve_track_id(track_id, auth["user"]["id"], access_token, config)
+    if track_id:
+        res = await spotify_request("PUT", "/me/tracks", access_token, config, params={"ids": track_id})
+        if res.status_code in [200, 204]:
+            _liked_cache.set((auth["user"]["id"], track_id), True)
+            playback_changed(auth["user"]["id"])
+            return {"success": True, "action": "liked", "track_id": track_id}
+        handle_spotify_error(res)
     
     raise HTTPException(status_code=400, detail="No track playing")
 
 @app.get("/dislike")
 @limiter.limit("20/minute")
-def dislike_track(request: Request, auth: str = Depends(verify_api_key), session_token: str = Cookie(None, alias="session_token")):
-    config = get_user_config_from_session(session_token)
-    access_token = get_valid_token(config)
-    current = spotify_request("GET", "/me/player", access_token, config)
-    if current.status_code == 200:
-        data = current.json()
-        track_id = data.get("item", {}).get("id")
-        if track_id:
-            res = spotify_request("DELETE", f"/me/tracks?ids={track_id}", access_token, config)
-            if res.status_code in [200, 204]:
-                return {"success": True, "action": "disliked", "track_id": track_id}
-            handle_spotify_error(res)
+async def dislike_track(request: Request, track_id: str = None, auth: str = Depends(verify_api_key)):
+    config = auth["config"]
+    access_token = await get_valid_token(config)
+    track_id = await resolve_track_id(track_id, auth["user"]["id"], access_token, config)
+    if track_id:
+        res = await spotify_request("DELETE", "/me/tracks", access_token, config, params={"ids": track_id})
+        if res.status_code in [200, 204]:
+            _liked_cache.set((auth["user"]["id"], track_id), False)
+            playback_changed(auth["user"]["id"])
+            return {"success": True, "action": "disliked", "track_id": track_id}
+        handle_spotify_error(res)
     
     raise HTTPException(status_code=400, detail="No track playing")
 
 @app.get("/queue")
 @limiter.limit("60/minute")
-def get_queue(request: Request, auth: str = Depends(verify_api_key), session_token: str = Cookie(None, alias="session_token")):
-    config = get_user_config_from_session(session_token)
-    access_token = get_valid_token(config)
-    res = spotify_request("GET", "/me/player/queue", access_token, config)
+async def get_queue(request: Request, auth: str = Depends(verify_api_key)):
+    config = auth["config"]
+    access_token = await get_valid_token(config)
+    res = await spotify_request("GET", "/me/player/queue", access_token, config)
 
     if res.status_code != 200:
         handle_spotify_error(res)
 
-    data = res.json()
-    queue_items = data.get("queue", [])
-
-    queue_list = []
-    for i, item in enumerate(queue_items[:20]):
-        album = item.get("album", {})
-        images = album.get("images", [])
-        thumbnail = images[1]["url"] if len(images) > 1 else (images[0]["url"] if images else "")
-        artists = ", ".join(a["name"] for a in item.get("artists", []))
-
-        queue_list.append({
-            "index": i + 1,
-            "track": item.get("name", ""),
-            "artist": artists,
-            "album": album.get("name", ""),
-            "thumbnail": thumbnail,
-            "id": item.get("id", "")
-        })
+    data = orjson.loads(res.content)
+    queue_items = data.get("queue") or ()
+
+    queue_list = [_format_track(item, i) for i, item in enumerate(queue_items[:20], 1)]
 
     current = data.get("currently_playing")
-    current_info = None
-    if current:
-        c_album = current.get("album", {})
-        c_images = c_album.get("images", [])
-        c_thumb = c_images[1]["url"] if len(c_images) > 1 else (c_images[0]["url"] if c_images else "")
-        current_info = {
-            "track": current.get("name", ""),
-            "artist": ", ".join(a["name"] for a in current.get("artists", [])),
-            "album": c_album.get("name", ""),
-            "thumbnail": c_thumb,
-            "id": current.get("id", "")
-        }
+    current_info = _format_track(current) if current else None
 
-    return {
+    return ORJSONResponse({
         "success": True,
         "currently_playing": current_info,
         "up_next": queue_list,
         "total": len(queue_list)
-    }
+    })
+
+_SHUFFLE_STATES = {
+    "true": (True, "/me/player/shuffle?state=true"),
+    "false": (False, "/me/player/shuffle?state=false"),
+}
 
 @app.get("/shuffle/{state}")
 @limiter.limit("20/minute")
-def toggle_shuffle(state: str, request: Request, auth: str = Depends(verify_api_key), session_token: str = Cookie(None, alias="session_token")):
-    config = get_user_config_from_session(session_token)
-    access_token = get_valid_token(config)
-    
-    if state.lower() not in ["true", "false"]:
+async def toggle_shuffle(state: str, request: Request, auth: str = Depends(verify_api_key)):
+    try:
+        shuffle_state, endpoint = _SHUFFLE_STATES[state.lower()]
+    except KeyError:
         raise HTTPException(status_code=400, detail="State must be 'true' or 'false'")
-    
-    res = spotify_request("PUT", f"/me/player/shuffle?state={state.lower()}", access_token, config)
+
+    config = auth["config"]
+    access_token = await get_valid_token(config)
+    res = await spotify_request("PUT", endpoint, access_token, config)
     
     if res.status_code in [204, 200]:
+        playback_changed(auth["user"]["id"])
         return {
             "success": True,
-            "shuffle_state": state.lower() == "true"
+            "shuffle_state": shuffle_state
         }
     else:
         handle_spotify_error(res)
 
 @app.get("/queue/{index}")
 @limiter.limit("20/minute")
-def play_from_queue(index: int, request: Request, auth: str = Depends(verify_api_key), session_token: str = Cookie(None, alias="session_token")):
-    config = get_user_config_from_session(session_token)
-    access_token = get_valid_token(config)
-    player_res = spotify_request("GET", "/me/player", access_token, config)
-    if player_res.status_code != 200:
-        raise HTTPException(status_code=player_res.status_code, detail="Cannot get player info")
-    
-    player_data = player_res.json()
-    context = player_data.get("context") or {}
-    context_uri = context.get("uri")
-
-    queue_res = spotify_request("GET", "/me/player/queue", access_token, config)
-    if queue_res.status_code != 200:
-        raise HTTPException(status_code=queue_res.status_code, detail="Failed to get queue")
-
-    queue_data = queue_res.json()
-    queue_list = queue_data.get("queue", [])
-    current = queue_data.get("currently_playing", {})
-    full_list = [current] + queue_list
-
-    if index < 0 or index >= len(full_list):
+async def play_from_queue(index: int, request: Request, context_uri: str = None, auth: str = Depends(verify_api_key)):
+    if index < 0:
         raise HTTPException(status_code=400, detail=f"Index {index} out of range")
 
-    target_track = full_list[index]
+    config = auth["config"]
+    access_token = await get_valid_token(config)
+    if index and context_uri:
+        # The client passed the context from /current, so /me/player isn't needed
+        queue_res = await spotify_request("GET", "/me/player/queue", access_token, config)
+    else:
+        player_call = fetch_player(auth["user"]["id"], access_token, config)
+        if index == 0:
+            # The current track is already in /me/player, so the queue isn't needed
+            player_res, queue_res = await player_call, None
+        else:
+            player_res, queue_res = await asyncio.gather(
+                player_call,
+                spotify_request("GET", "/me/player/queue", access_token, config),
+            )
+        if player_res.status_code != 200:
+            raise HTTPException(status_code=player_res.status_code, detail="Cannot get player info")
+        player_data = orjson.loads(player_res.content)
+        context_uri = (player_data.get("context") or _EMPTY).get("uri")
+
+    if queue_res is None:
+        target_track = player_data.get("item") or _EMPTY
+    else:
+        if queue_res.status_code != 200:
+            raise HTTPException(status_code=queue_res.status_code, detail="Failed to get queue")
+        queue_list = orjson.loads(queue_res.content).get("queue") or ()
+        if index > len(queue_list):
+            raise HTTPException(status_code=400, detail=f"Index {index} out of range")
+        target_track = queue_list[index - 1]
+
     track_id = target_track.get("id")
+    if not track_id:
+        raise HTTPException(status_code=400, detail=f"Index {index} out of range")
 
     if context_uri:
         body = {"context_uri": context_uri, "offset": {"uri": f"spotify:track:{track_id}"}}
     else:
         body = {"uris": [f"spotify:track:{track_id}"]}
 
-    res = spotify_request("PUT", "/me/player/play", access_token, config, json=body)
+    res = await spotify_request("PUT", "/me/player/play", access_token, config, json=body)
 
     if res.status_code in [204, 200]:
-        return {
+        playback_changed(auth["user"]["id"], track_changed=True)
+        return ORJSONResponse({
             "success": True,
-            "message": f"Now playing {target_track.get('name')} by {', '.join(a['name'] for a in target_track.get('artists', []))}",
+            "message": f"Now playing {target_track.get('name')} by {_join_artists(target_track.get('artists') or ())}",
             "track_id": track_id,
             "used_context": bool(context_uri)
-        }
+        })
     else:
         handle_spotify_error(res)
 
 @app.get("/seek/{percent}")
 @limiter.limit("60/minute")
-def seek_position(percent: int, request: Request, auth: str = Depends(verify_api_key), session_token: str = Cookie(None, alias="session_token")):
+async def seek_position(percent: int, request: Request, auth: str = Depends(verify_api_key)):
     if not (0 <= percent <= 100):
         raise HTTPException(status_code=400, detail="Percent must be between 0 and 100")
 
-    config = get_user_config_from_session(session_token)
-    access_token = get_valid_token(config)
-    current_res = spotify_request("GET", "/me/player", access_token, config)
+    config = auth["config"]
+    access_token = await get_valid_token(config)
+    current_res = await fetch_player(auth["user"]["id"], access_token, config)
     if current_res.status_code != 200:
         handle_spotify_error(current_res)
     
-    current_data = current_res.json()
+    current_data = orjson.loads(current_res.content)
     duration_ms = current_data.get("item", {}).get("duration_ms", 0)
     
     if duration_ms == 0:
         raise HTTPException(status_code=400, detail="Cannot determine track duration")
     
     position_ms = int((percent / 100) * duration_ms)
-    res = spotify_request("PUT", f"/me/player/seek?position_ms={position_ms}", access_token, config)
+    res = await spotify_request("PUT", f"/me/player/seek?position_ms={position_ms}", access_token, config)
     
     if res.status_code in [204, 200]:
+        playback_changed(auth["user"]["id"])
         return {
             "success": True,
             "position_ms": position_ms,
@@ -863,15 +1254,16 @@ def seek_position(percent: int, request: Request, auth: str = Depends(verify_api
 
 @app.get("/volume/{level}")
 @limiter.limit("20/minute")
-def set_volume(level: int, request: Request, auth: str = Depends(verify_api_key), session_token: str = Cookie(None, alias="session_token")):
+async def set_volume(level: int, request: Request, auth: str = Depends(verify_api_key)):
     if not (0 <= level <= 100):
         raise HTTPException(status_code=400, detail="Volume must be between 0 and 100")
 
-    config = get_user_config_from_session(session_token)
-    access_token = get_valid_token(config)
-    res = spotify_request("PUT", f"/me/player/volume?volume_percent={level}", access_token, config)
+    config = auth["config"]
+    access_token = await get_valid_token(config)
+    res = await spotify_request("PUT", f"/me/player/volume?volume_percent={level}", access_token, config)
 
     if res.status_code in [204, 200]:
+        playback_changed(auth["user"]["id"])
         return {
             "success": True,
             "volume_percent": level
@@ -881,14 +1273,14 @@ def set_volume(level: int, request: Request, auth: str = Depends(verify_api_key)
 
 @app.get("/force-renew")
 @limiter.limit("5/minute")
-def force_renew(request: Request, auth: str = Depends(verify_api_key), session_token: str = Cookie(None, alias="session_token")):
-    config = get_user_config_from_session(session_token)
-    cached = load_token_from_gist_for_user(config=config)
+async def force_renew(request: Request, auth: str = Depends(verify_api_key)):
+    config = auth["config"]
+    cached = await load_token_from_gist_for_user(config=config)
     refresh_token = cached.get("refresh_token", "")
     if not refresh_token:
         return {"error": "No refresh_token found in Gist"}
 
-    token_data = renew_access_token(refresh_token, config)
+    token_data = await renew_access_token(refresh_token, config)
     return (
         {"success": True, "message": "Token renewed", "expires_in": token_data.get("expires_in", 3600)}
         if token_data
@@ -896,12 +1288,12 @@ def force_renew(request: Request, auth: str = Depends(verify_api_key), session_t
     )
 
 @app.get("/debug")
-def debug(auth: str = Depends(verify_api_key), session_token: str = Cookie(None, alias="session_token")):
+async def debug(auth: str = Depends(verify_api_key)):
     if ENVIRONMENT != "development":
         raise HTTPException(status_code=404, detail="Not found")
     
-    config = get_user_config_from_session(session_token)
-    cached = load_token_from_gist_for_user(config=config)
+    config = auth["config"]
+    cached = await load_token_from_gist_for_user(config=config)
     expires_at = cached.get("expires_at", 0)
     expires_in = int(expires_at - time.time())
     
@@ -913,28 +1305,28 @@ def debug(auth: str = Depends(verify_api_key), session_token: str = Cookie(None,
     }
 
 @app.get("/gettoken")
-def get_token(auth: str = Depends(verify_api_key), session_token: str = Cookie(None, alias="session_token")):
+async def get_token(auth: str = Depends(verify_api_key)):
     if ENVIRONMENT != "development":
         raise HTTPException(status_code=404, detail="Not found")
     
     try:
-        config = get_user_config_from_session(session_token)
-        access_token = get_valid_token(config)
+        config = auth["config"]
+        access_token = await get_valid_token(config)
         return {"success": True, "access_token": access_token}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/init")
-async def init_tokens(request: dict, auth: str = Depends(verify_api_key), session_token: str = Cookie(None, alias="session_token")):
+async def init_tokens(request: dict, auth: str = Depends(verify_api_key)):
     access_token = request.get("access_token", "")
     refresh_token = request.get("refresh_token", "")
     
     if not access_token or not refresh_token:
         return {"error": "Both access_token and refresh_token required"}
 
-    config = get_user_config_from_session(session_token)
+    config = auth["config"]
     expires_at = time.time() + 3600
-    success = save_token_to_gist(access_token, refresh_token, expires_at, config)
+    success = await save_token_to_gist(access_token, refresh_token, expires_at, config)
     
     return (
         {"success": True, "message": "Tokens saved to Gist", "expires_in": 3600}
@@ -944,7 +1336,7 @@ async def init_tokens(request: dict, auth: str = Depends(verify_api_key), sessio
 
 # Legacy login route - redirect to new flow
 @app.get("/login")
-def login():
+async def login():
     return RedirectResponse("/welcome")
 
 app = app
\ No newline at end of file
@@ -11,6 +11,7 @@ const CONFIG = {
 const state = {
     isPlaying: false,
     currentTrackId: null,
+    contextUri: null,
     isActionInProgress: false,
     isDeviceOffline: false,
     consecutiveFailures: 0,
@@ -77,7 +78,11 @@ async function apiRequest(endpoint, options = {}) {
 
 async function fetchState() {
     try {
-        const res = await apiRequest('current');
+        // Lets the server check liked state in parallel with the player lookup
+        const endpoint = state.currentTrackId
+            ? `current?track_id=${encodeURIComponent(state.currentTrackId)}`
+            : 'current';
+        const res = await apiRequest(endpoint);
 
         if (!res.ok) {
             handleFetchError(res.status);
@@ -171,6 +176,7 @@ function updateUI(data) {
         fetchQueue();
     }
 
+    state.contextUri = data.context_uri || null;
     state.isPlaying = data.is_playing;
     togglePlayIcon(state.isPlaying);
 
@@ -361,7 +367,7 @@ function getPlaceholderImage() {
     return 'data:image/svg+xml,<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 40 40"><rect fill="%23333" width="40" height="40"/><text x="50%" y="50%" fill="%23666" font-size="12" text-anchor="middle" dy=".3em">♪</text></svg>';
 }
 
-async function control(action) {
+async function control(action, query = "") {
     if (state.isActionInProgress || state.isDeviceOffline) {
         if (state.isDeviceOffline) {
             showToast('Device is offline', 'error');
@@ -371,7 +377,7 @@ async function control(action) {
     state.isActionInProgress = true;
 
     try {
-        const res = await apiRequest(action);
+        const res = await apiRequest(action + query);
         if (!res.ok) {
             if (res.status === 404 || res.status === 403) {
                 showOfflineState();
@@ -413,7 +419,11 @@ async function toggleShuffle() {
 
 function toggleLike() {
     const isLiked = els.likeBtn?.classList.contains("active");
-    control(isLiked ? "dislike" : "like");
+    // Naming the track lets the server skip its own /me/player lookup
+    const query = state.currentTrackId
+        ? `?track_id=${encodeURIComponent(state.currentTrackId)}`
+        : "";
+    control(isLiked ? "dislike" : "like", query);
 }
 
 async function playQueue(index) {
@@ -422,7 +432,11 @@ async function playQueue(index) {
         return;
     }
     try {
-        const res = await apiRequest(`queue/${index}`);
+        // Passing the playing context lets the server skip its own /me/player lookup
+        const query = state.contextUri
+            ? `?context_uri=${encodeURIComponent(state.contextUri)}`
+            : "";
+        const res = await apiRequest(`queue/${index}${query}`);
         if (!res.ok) {
             if (res.status === 404 || res.status === 403) {
                 showOfflineState();
@@ -0,0 +1,48 @@
+import asyncio
+import time
+import unittest
+
+from throttle import TokenBucket
+
+
+class TokenBucketTest(unittest.IsolatedAsyncioTestCase):
+    async def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=20, burst=2)
+        start = time.monotonic()
+        for _ in range(2):
+            await bucket.acquire()
+        self.assertLess(time.monotonic() - start, 0.02)
+        for _ in range(4):
+            await bucket.acquire()
+        # 4 calls past the burst at 20/s
+        self.assertAlmostEqual(time.monotonic() - start, 0.2, delta=0.05)
+
+    async def test_pause_holds_callers(self):
+        bucket = TokenBucket(rate=100, burst=5)
+        bucket.pause(0.2)
+        start = time.monotonic()
+        await bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    async def test_pause_keeps_longest(self):
+        bucket = TokenBucket(rate=100, burst=5)
+        bucket.pause(0.2)
+        bucket.pause(0.05)
+        start = time.monotonic()
+        await bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    async def test_waiters_served_in_order(self):
+        bucket = TokenBucket(rate=50, burst=1)
+        order = []
+
+        async def call(i):
+            await bucket.acquire()
+            order.append(i)
+
+        await asyncio.gather(*(call(i) for i in range(5)))
+        self.assertEqual(order, list(range(5)))
+
+
+if __name__ == "__main__":
+    unittest.main()